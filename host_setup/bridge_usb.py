@@ -4,7 +4,6 @@ USB to TAP Bridge
 Bridges data between ESP32 USB serial and TAP interface
 """
 
-import serial
 import struct
 import socket
 import select
@@ -12,16 +11,36 @@ import sys
 import os
 import fcntl
 import argparse
-import glob
+import errno
+import termios
+import time
+import tty
+
+from usb_detect import cached_detect, watch_dev, wait_for_esp32
+
+try:
+    import bridge_core  # native copy loop, built with: python3 setup.py build_ext --inplace
+except ImportError:
+    bridge_core = None
 
 TAP_IF = "esp0"           # safer than tap0, less likely to conflict
-BAUDRATE = 921600         # High speed for network traffic
-ESPRESSIF_USB_VID = "303a"  # Espressif vendor ID (seed XIAO ESP32-C3 uses this)
+BAUDRATE = termios.B921600  # High speed for network traffic
+FRAME_MAX = 1518          # Max L2 frame from TAP: 1500 MTU + 14 header + 4 VLAN tag
+USB_READ_SIZE = 4096      # Max bytes taken from USB per read
+RECONNECT_RETRY_S = 0.5   # Delay before retrying a failed USB reopen
+USB_GONE_ERRNOS = (errno.EIO, errno.ENODEV, errno.ENXIO)  # USB device unplugged
 
 # TUN/TAP ioctl constants
 TUNSETIFF = 0x400454ca
 IFF_TAP = 0x0002
 IFF_NO_PI = 0x1000
+_IFR_BYTES = struct.pack('16sH', TAP_IF.encode(), IFF_TAP | IFF_NO_PI)  # struct ifreq for TUNSETIFF
+
+# Serial low-latency ioctl constants
+TIOCGSERIAL = 0x541E
+TIOCSSERIAL = 0x541F
+ASYNC_LOW_LATENCY = 1 << 13
+SERIAL_FLAGS_OFFSET = 16  # struct serial_struct: type, line, port, irq, flags
 
 
 def parse_args():
@@ -29,91 +48,179 @@ def parse_args():
     parser.add_argument(
         "--dev", "-d",
         default=None,
-        help="USB serial device (e.g. /dev/ttyACM1). "
+        help="USB serial device (e.g. /dev/ttyACM1 or a /dev/serial/by-id/ "
+             "link). A by-id link is followed across re-plugs only while its "
+             "directory exists; if udev removes it, just the old ttyACM node "
+             "is waited for. "
              "If omitted, auto-detect ESP32 (VID 303a) on /dev/ttyACM*"
     )
+    parser.add_argument(
+        "--busy-poll-us",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Spin for up to N microseconds polling for new data before "
+             "sleeping in epoll (lower latency, higher CPU). Default: 0 (off)"
+    )
     return parser.parse_args()
 
 
-def find_usb_parent_sysfs(tty_path):
+def open_usb(usb_dev):
+    """Open USB serial device as a raw, non-blocking tty"""
+    usb_fd = os.open(usb_dev, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+    try:
+        tty.setraw(usb_fd)
+        attrs = termios.tcgetattr(usb_fd)
+        attrs[2] |= termios.CLOCAL | termios.CREAD
+        attrs[4] = BAUDRATE  # ispeed
+        attrs[5] = BAUDRATE  # ospeed
+        termios.tcsetattr(usb_fd, termios.TCSANOW, attrs)
+    except Exception:
+        os.close(usb_fd)
+        raise
+    return usb_fd
+
+
+def set_low_latency(usb_dev, usb_fd):
     """
-    Given /dev/ttyACM0, find the corresponding USB device sysfs directory
-    that contains idVendor / idProduct.
+    Ask the USB serial driver to complete reads on a 1ms tick instead of
+    its default latency (often 16ms). Both mechanisms are best-effort:
+    plain CDC-ACM has no latency_timer and may reject TIOCSSERIAL.
     """
-    tty_name = os.path.basename(tty_path)  # e.g. ttyACM0
-    base = f"/sys/class/tty/{tty_name}"
-    if not os.path.exists(base):
-        return None
-
-    # Walk up a few levels until we find idVendor
-    path = os.path.realpath(os.path.join(base, "device"))
-    for _ in range(5):
-        vid_path = os.path.join(path, "idVendor")
-        pid_path = os.path.join(path, "idProduct")
-        if os.path.exists(vid_path) and os.path.exists(pid_path):
-            return path
-        new_path = os.path.dirname(path)
-        if new_path == path:
+    tty_name = os.path.basename(usb_dev)
+    for timer_path in (f"/sys/bus/usb-serial/devices/{tty_name}/latency_timer",
+                       f"/sys/class/tty/{tty_name}/device/latency_timer"):
+        try:
+            with open(timer_path, "w") as f:
+                f.write("1")
+            print(f"Set {timer_path} to 1ms")
             break
-        path = new_path
-    return None
+        except OSError:
+            continue
 
+    try:
+        buf = bytearray(128)  # larger than struct serial_struct
+        fcntl.ioctl(usb_fd, TIOCGSERIAL, buf)
+        flags, = struct.unpack_from("i", buf, SERIAL_FLAGS_OFFSET)
+        struct.pack_into("i", buf, SERIAL_FLAGS_OFFSET, flags | ASYNC_LOW_LATENCY)
+        fcntl.ioctl(usb_fd, TIOCSSERIAL, buf)
+    except OSError:
+        pass
 
-def detect_esp32_acm():
+
+def reopen_usb(usb_dev):
     """
-    Auto-detect ESP32 (Espressif VID 303a) among /dev/ttyACM* devices.
-    Returns path string or None.
+    Open a re-plugged USB device, retrying while udev finishes setting it up.
+    Returns the fd, or None if the device node disappeared again.
     """
-    candidates = sorted(glob.glob("/dev/ttyACM*"))
-    if not candidates:
-        print("Auto-detect: no /dev/ttyACM* devices found")
-        return None
-
-    print("Auto-detect: scanning /dev/ttyACM* for ESP32 (VID 303a)...")
-    esp_ports = []
-
-    for dev in candidates:
-        sysfs_usb = find_usb_parent_sysfs(dev)
-        if not sysfs_usb:
-            print(f"  {dev}: no USB parent sysfs with idVendor/idProduct")
+    while os.path.exists(usb_dev):
+        try:
+            usb_fd = open_usb(usb_dev)
+        except OSError as e:
+            print(f"Error opening {usb_dev}: {e}")
+            time.sleep(RECONNECT_RETRY_S)
             continue
+        set_low_latency(usb_dev, usb_fd)
+        return usb_fd
+    return None
+
 
+def write_all(fd, data):
+    """Write all of data to a non-blocking fd, waiting while it is full"""
+    view = memoryview(data)
+    while view:
         try:
-            with open(os.path.join(sysfs_usb, "idVendor"), "r") as f:
-                vid = f.read().strip().lower()
-            with open(os.path.join(sysfs_usb, "idProduct"), "r") as f:
-                pid = f.read().strip().lower()
-        except OSError:
-            print(f"  {dev}: failed to read idVendor/idProduct")
+            n = os.write(fd, view)
+        except BlockingIOError:
+            select.select([], [fd], [])
             continue
+        view = view[n:]
 
-        print(f"  {dev}: VID={vid}, PID={pid}")
-        if vid == ESPRESSIF_USB_VID:
-            esp_ports.append(dev)
-
-    if len(esp_ports) == 1:
-        print(f"Auto-detect: selected {esp_ports[0]} (Espressif VID 303a)")
-        return esp_ports[0]
-    elif len(esp_ports) > 1:
-        print("Auto-detect: multiple ESP32-like devices found:")
-        for p in esp_ports:
-            print(f"  - {p}")
-        print("Using the first one; specify --dev explicitly if this is wrong.")
-        return esp_ports[0]
-    else:
-        print("Auto-detect: no ESP32 (VID 303a) found on /dev/ttyACM*")
-        print("Falling back to first /dev/ttyACM* device.")
-        return candidates[0]
+
+def send_usb(usb_fd, data):
+    """write_all() to the USB fd; returns False if the device went away"""
+    try:
+        write_all(usb_fd, data)
+    except OSError as e:
+        if e.errno in USB_GONE_ERRNOS:
+            return False
+        raise
+    return True
 
 
 def create_tap():
     """Create and configure TAP interface"""
-    tap_fd = os.open("/dev/net/tun", os.O_RDWR)
-    ifr = struct.pack('16sH', TAP_IF.encode(), IFF_TAP | IFF_NO_PI)
-    fcntl.ioctl(tap_fd, TUNSETIFF, ifr)
+    tap_fd = os.open("/dev/net/tun", os.O_RDWR | os.O_NONBLOCK)
+    fcntl.ioctl(tap_fd, TUNSETIFF, _IFR_BYTES)
     return tap_fd
 
 
+def poll_events(ep, busy_poll_ns):
+    """Wait for epoll events, busy-polling for up to busy_poll_ns first"""
+    if busy_poll_ns:
+        deadline = time.perf_counter_ns() + busy_poll_ns
+        while time.perf_counter_ns() < deadline:
+            events = ep.poll(0)
+            if events:
+                return events
+    return ep.poll(-1)
+
+
+def bridge_loop(usb_fd, tap_fd, busy_poll_us=0):
+    """
+    Copy data between USB and TAP (pure Python).
+    Returns when the USB device goes away; Ctrl+C raises KeyboardInterrupt.
+    """
+    # Edge-triggered epoll on both sides: block until either fd is readable,
+    # then drain it completely before waiting again.
+    # io_uring is not used here: the stdlib has no binding, and a third-party
+    # liburing wrapper would add a host dependency for little gain with two
+    # fds (IORING_RECVSEND_BUNDLE is socket-only anyway).
+    ep = select.epoll()
+    ep.register(tap_fd, select.EPOLLIN | select.EPOLLET)
+    ep.register(usb_fd, select.EPOLLIN | select.EPOLLET)
+
+    # Receive buffers are allocated once and reused for every read
+    usb_buf = memoryview(bytearray(USB_READ_SIZE))
+    tap_buf = memoryview(bytearray(FRAME_MAX))
+
+    busy_poll_ns = busy_poll_us * 1000
+
+    try:
+        while True:
+            for fd, _ in poll_events(ep, busy_poll_ns):
+                if fd == usb_fd:
+                    # Data from USB -> TAP
+                    while True:
+                        try:
+                            n = os.readv(usb_fd, [usb_buf])
+                        except BlockingIOError:
+                            break
+                        except OSError as e:
+                            if e.errno in USB_GONE_ERRNOS:
+                                return
+                            raise
+                        if not n:
+                            return  # tty hung up
+                        # Each TAP write is exactly one frame
+                        os.write(tap_fd, usb_buf[:n])
+                elif fd == tap_fd:
+                    # Data from TAP -> USB. The USB link has no framing:
+                    # the firmware treats each USB transfer as one packet,
+                    # so every frame is written on its own, never batched.
+                    while True:
+                        try:
+                            n = os.readv(tap_fd, [tap_buf])
+                        except BlockingIOError:
+                            break
+                        if not n:
+                            break
+                        if not send_usb(usb_fd, tap_buf[:n]):
+                            return
+    finally:
+        ep.close()
+
+
 def main():
     if os.geteuid() != 0:
         print("Error: This script must be run as root")
@@ -127,7 +234,7 @@ def main():
         usb_dev = args.dev
         print(f"Using USB device from argument: {usb_dev}")
     else:
-        usb_dev = detect_esp32_acm()
+        usb_dev = cached_detect()
         if not usb_dev:
             print("Failed to auto-detect any suitable /dev/ttyACM* device.")
             sys.exit(1)
@@ -139,7 +246,8 @@ def main():
 
     # Open USB serial
     try:
-        ser = serial.Serial(usb_dev, BAUDRATE, timeout=0.1)
+        usb_fd = open_usb(usb_dev)
+        set_low_latency(usb_dev, usb_fd)
         print(f"Connected to {usb_dev}")
     except Exception as e:
         print(f"Error opening {usb_dev}: {e}")
@@ -153,30 +261,53 @@ def main():
     except Exception as e:
         print(f"Error creating TAP interface: {e}")
         print("Make sure /dev/net/tun exists (sudo modprobe tun)")
-        ser.close()
+        os.close(usb_fd)
+        sys.exit(1)
+
+    # Watch /dev from the start so a re-plugged device is never missed.
+    # --dev may be a symlink (e.g. /dev/serial/by-id/...), which is gone
+    # after an unplug, so watch its directory too and remember the node it
+    # points at now.
+    try:
+        inotify_fd = watch_dev(args.dev)
+    except OSError as e:
+        print(f"Error watching /dev for USB reconnects: {e}")
+        print("Check the inotify limits (sysctl fs.inotify.max_user_watches / max_user_instances)")
+        os.close(tap_fd)
+        os.close(usb_fd)
         sys.exit(1)
+    dev_node = os.path.realpath(args.dev) if args.dev else None
 
     print("Bridge running... (Ctrl+C to stop)")
+    if args.busy_poll_us:
+        print(f"Busy-polling for up to {args.busy_poll_us}us before sleeping")
+    if bridge_core is None:
+        print("Note: native bridge_core not built, using Python loop")
 
     try:
         while True:
-            # Check for data from USB
-            if ser.in_waiting > 0:
-                data = ser.read(ser.in_waiting)
-                if data:
-                    os.write(tap_fd, data)
-
-            # Check for data from TAP
-            ready, _, _ = select.select([tap_fd], [], [], 0.1)
-            if ready:
-                data = os.read(tap_fd, 1500)  # Ethernet MTU
-                if data:
-                    ser.write(data)
+            if bridge_core is not None:
+                bridge_core.run(usb_fd, tap_fd, args.busy_poll_us)
+            else:
+                bridge_loop(usb_fd, tap_fd, args.busy_poll_us)
 
+            # The bridge only returns when the USB device went away. The
+            # node may still be there (hang-up without re-enumeration), and
+            # then no create event will come, so try it once before waiting.
+            os.close(usb_fd)
+            usb_fd = reopen_usb(usb_dev)
+            if usb_fd is None:
+                print(f"USB device {usb_dev} disconnected, waiting for it to reappear...")
+            while usb_fd is None:
+                usb_dev = wait_for_esp32(inotify_fd, args.dev, dev_node)
+                usb_fd = reopen_usb(usb_dev)
+            print(f"Reconnected to {usb_dev}")
     except KeyboardInterrupt:
         print("\nStopping bridge...")
     finally:
-        ser.close()
+        if usb_fd is not None:
+            os.close(usb_fd)
+        os.close(inotify_fd)
         os.close(tap_fd)
         print("Bridge stopped")
 
@@ -0,0 +1,12 @@
+#!/usr/bin/env python3
+"""
+Build the optional native bridge loop used by bridge_usb.py
+Usage: python3 setup.py build_ext --inplace
+"""
+
+from setuptools import setup, Extension
+
+setup(
+    name="bridge_core",
+    ext_modules=[Extension("bridge_core", sources=["bridge_core.c"])],
+)
@@ -6,14 +6,26 @@ Configures routing table to route traffic through esp0 interface
 
 import os
 import sys
-import subprocess
+import asyncio
+import socket
+import select
+import struct
+import time
 import argparse
 import json
 
+from pyroute2 import IPRoute, NetlinkError
+
 ESP0_IF = "esp0"
 ESP0_GATEWAY = "192.168.7.1"
 HOST_IP = "192.168.7.2"
 ROUTES_FILE = "/tmp/esp32_routes_backup.json"
+INTERNET_TEST_IP = "8.8.8.8"
+PING_TIMEOUT = 2  # seconds
+PING_COUNT = 2  # echoes per target, like ping -c 2
+PING_INTERVAL = 1  # seconds between echoes, like ping
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
 
 
 def check_root():
@@ -24,55 +36,70 @@ def check_root():
         sys.exit(1)
 
 
-def run_command(cmd, check=True, capture_output=True):
-    """Run a shell command"""
-    try:
-        result = subprocess.run(
-            cmd,
-            shell=True,
-            check=check,
-            capture_output=capture_output,
-            text=True
-        )
-        return result
-    except subprocess.CalledProcessError as e:
-        if check:
-            print(f"Error running command: {cmd}")
-            print(f"Error: {e}")
-            sys.exit(1)
-        return None
-
-
 def interface_exists(ifname):
     """Check if network interface exists"""
-    result = run_command(
-        f"ip link show {ifname}",
-        check=False,
-        capture_output=True
-    )
-    return result.returncode == 0
+    return os.path.isdir(f"/sys/class/net/{ifname}")
+
+
+def route_via_esp0(cmd, network, metric=None):
+    """Add or delete a route via the ESP32 gateway over netlink"""
+    with IPRoute() as ipr:
+        links = ipr.link_lookup(ifname=ESP0_IF)
+        if not links:
+            return False
+        route = {"dst": network, "gateway": ESP0_GATEWAY, "oif": links[0]}
+        if metric:
+            route["priority"] = metric
+        try:
+            ipr.route(cmd, **route)
+        except NetlinkError:
+            return False
+    return True
 
 
-def get_current_default_route():
+def get_current_routes():
+    """Get all current IPv4 routes (main table) as JSON-friendly dicts"""
+    with IPRoute() as ipr:
+        links = {link["index"]: link.get_attr("IFLA_IFNAME") for link in ipr.get_links()}
+        routes = []
+        for r in ipr.get_routes(family=socket.AF_INET, table=254):
+            dst = r.get_attr("RTA_DST")
+            routes.append({
+                "dst": f"{dst}/{r['dst_len']}" if dst else None,
+                "gateway": r.get_attr("RTA_GATEWAY"),
+                "dev": links.get(r.get_attr("RTA_OIF")),
+                "metric": r.get_attr("RTA_PRIORITY"),
+                "prefsrc": r.get_attr("RTA_PREFSRC"),
+            })
+    return routes
+
+
+def get_current_default_route(routes=None):
     """Get current default route"""
-    result = run_command("ip route show default", check=False, capture_output=True)
-    if result.returncode == 0 and result.stdout.strip():
-        return result.stdout.strip()
+    if routes is None:
+        routes = get_current_routes()
+    for route in routes:
+        if route["dst"] is None:
+            return route
     return None
 
 
-def get_current_routes():
-    """Get all current routes"""
-    result = run_command("ip route show", check=False, capture_output=True)
-    if result.returncode == 0:
-        return result.stdout.strip().split('\n')
-    return []
+def format_route(route):
+    """Format a route dict the way 'ip route show' would"""
+    parts = [route["dst"] or "default"]
+    if route.get("gateway"):
+        parts.append(f"via {route['gateway']}")
+    if route.get("dev"):
+        parts.append(f"dev {route['dev']}")
+    if route.get("metric") is not None:
+        parts.append(f"metric {route['metric']}")
+    return " ".join(parts)
 
 
 def backup_routes():
     """Backup current routing configuration"""
-    default_route = get_current_default_route()
     routes = get_current_routes()
+    default_route = get_current_default_route(routes)
     
     backup = {
         "default_route": default_route,
@@ -101,8 +128,12 @@ def restore_routes():
         
         # Note: We can't fully restore all routes automatically
         # User should restore manually if needed
-        if backup.get("default_route"):
-            print(f"Original default route was: {backup['default_route']}")
+        default_route = backup.get("default_route")
+        if default_route:
+            # Backups from older versions stored the raw 'ip route' line
+            if not isinstance(default_route, str):
+                default_route = format_route(default_route)
+            print(f"Original default route was: {default_route}")
             print("You may need to restore it manually if needed.")
         
         return True
@@ -122,15 +153,18 @@ def setup_default_route(metric=None):
     backup_routes()
     
     # Remove existing default route if it exists
-    result = run_command("ip route show default", check=False, capture_output=True)
-    if result.returncode == 0 and result.stdout.strip():
-        print("Removing existing default route...")
-        run_command("ip route del default", check=False)
+    with IPRoute() as ipr:
+        if ipr.get_default_routes(family=socket.AF_INET):
+            print("Removing existing default route...")
+            try:
+                ipr.route("del", dst="default", family=socket.AF_INET)
+            except NetlinkError as e:
+                print(f"Warning: Could not remove existing default route: {e}")
     
     # Add new default route through esp0
-    metric_str = f" metric {metric}" if metric else ""
-    cmd = f"ip route add default via {ESP0_GATEWAY} dev {ESP0_IF}{metric_str}"
-    run_command(cmd)
+    if not route_via_esp0("add", "default", metric):
+        print(f"Error: Could not add default route via {ESP0_GATEWAY} dev {ESP0_IF}")
+        sys.exit(1)
     print(f"✓ Set default route via {ESP0_GATEWAY} dev {ESP0_IF}")
     
     return True
@@ -142,11 +176,7 @@ def setup_specific_route(network, metric=None):
         print(f"Error: Interface {ESP0_IF} does not exist")
         return False
     
-    metric_str = f" metric {metric}" if metric else ""
-    cmd = f"ip route add {network} via {ESP0_GATEWAY} dev {ESP0_IF}{metric_str}"
-    
-    result = run_command(cmd, check=False)
-    if result.returncode == 0:
+    if route_via_esp0("add", network, metric):
         print(f"✓ Added route: {network} via {ESP0_GATEWAY} dev {ESP0_IF}")
         return True
     else:
@@ -156,9 +186,7 @@ def setup_specific_route(network, metric=None):
 
 def remove_default_route():
     """Remove default route through esp0"""
-    cmd = f"ip route del default via {ESP0_GATEWAY} dev {ESP0_IF}"
-    result = run_command(cmd, check=False)
-    if result.returncode == 0:
+    if route_via_esp0("del", "default"):
         print(f"✓ Removed default route via {ESP0_GATEWAY}")
         return True
     else:
@@ -168,9 +196,7 @@ def remove_default_route():
 
 def remove_specific_route(network):
     """Remove specific route"""
-    cmd = f"ip route del {network} via {ESP0_GATEWAY} dev {ESP0_IF}"
-    result = run_command(cmd, check=False)
-    if result.returncode == 0:
+    if route_via_esp0("del", network):
         print(f"✓ Removed route: {network}")
         return True
     else:
@@ -182,25 +208,93 @@ def show_routes():
     """Show current routing table"""
     print("\nCurrent routing table:")
     print("=" * 60)
-    run_command("ip route show", check=False, capture_output=False)
+    for route in get_current_routes():
+        print(format_route(route))
     print("=" * 60)
 
 
+def ping_targets(targets, timeout=PING_TIMEOUT):
+    """
+    Send PING_COUNT ICMP echoes to every target, PING_INTERVAL apart, and
+    wait for the replies; one reply is enough for a target to count.
+    Uses an unprivileged ICMP datagram socket (the kernel fills in the
+    identifier and checksum). Returns the set of targets that replied.
+    """
+    reachable = set()
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP) as sock:
+        pending = set(targets)
+        seq = 0
+        sent = 0
+        start = time.monotonic()
+        deadline = start + timeout
+        while pending:
+            now = time.monotonic()
+            if sent < PING_COUNT and now >= start + sent * PING_INTERVAL:
+                for target in list(pending):
+                    seq += 1
+                    packet = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, 0, 0, seq)
+                    try:
+                        sock.sendto(packet, (target, 0))
+                    except OSError:
+                        if sent == 0:
+                            pending.discard(target)
+                sent += 1
+                continue
+
+            wake = deadline
+            if sent < PING_COUNT:
+                wake = min(wake, start + sent * PING_INTERVAL)
+            remaining = wake - now
+            if remaining <= 0:
+                break
+            ready, _, _ = select.select([sock], [], [], remaining)
+            if not ready:
+                continue
+            data, (addr, _) = sock.recvfrom(1024)
+            if data and data[0] == ICMP_ECHO_REPLY and addr in pending:
+                pending.discard(addr)
+                reachable.add(addr)
+    return reachable
+
+
+async def ping_targets_subprocess(targets):
+    """Run the ping command for every target concurrently; returns the set that replied"""
+    try:
+        procs = [
+            await asyncio.create_subprocess_exec(
+                "ping", "-c", "2", "-W", str(PING_TIMEOUT), target,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.DEVNULL
+            )
+            for target in targets
+        ]
+    except FileNotFoundError:
+        print("Warning: ping command not found")
+        return set()
+    codes = await asyncio.gather(*(p.wait() for p in procs))
+    return {target for target, code in zip(targets, codes) if code == 0}
+
+
 def test_connectivity():
     """Test connectivity through esp0"""
     print("\nTesting connectivity...")
     
+    targets = [ESP0_GATEWAY, INTERNET_TEST_IP]
+    try:
+        reachable = ping_targets(targets)
+    except PermissionError:
+        # ICMP datagram sockets not allowed (net.ipv4.ping_group_range)
+        reachable = asyncio.run(ping_targets_subprocess(targets))
+    
     # Test ESP32 gateway
-    result = run_command(f"ping -c 2 -W 2 {ESP0_GATEWAY}", check=False)
-    if result.returncode == 0:
+    if ESP0_GATEWAY in reachable:
         print(f"✓ Can reach ESP32 gateway ({ESP0_GATEWAY})")
     else:
         print(f"✗ Cannot reach ESP32 gateway ({ESP0_GATEWAY})")
     
     # Test internet (if ESP32 is connected to WiFi)
-    result = run_command("ping -c 2 -W 2 8.8.8.8", check=False)
-    if result.returncode == 0:
-        print("✓ Can reach internet (8.8.8.8)")
+    if INTERNET_TEST_IP in reachable:
+        print(f"✓ Can reach internet ({INTERNET_TEST_IP})")
     else:
         print("✗ Cannot reach internet (ESP32 may not be connected to WiFi)")
 
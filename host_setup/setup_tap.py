@@ -7,14 +7,16 @@ Creates a TAP interface and configures it for bridging with ESP32 USB connection
 import os
 import sys
 import subprocess
-import glob
 import argparse
 
+from pyroute2 import IPRoute, NetlinkError
+
+from usb_detect import cached_detect
+
 TAP_IF = "esp0"
 USB_DEV = None  # Will be auto-detected if not specified
 IP_ADDR = "192.168.7.1"
 NETMASK = "255.255.255.0"
-ESPRESSIF_USB_VID = "303a"
 
 
 def check_root():
@@ -25,77 +27,6 @@ def check_root():
         sys.exit(1)
 
 
-def find_usb_parent_sysfs(tty_path):
-    """
-    Given /dev/ttyACM0, find the corresponding USB device sysfs directory
-    that contains idVendor / idProduct.
-    """
-    tty_name = os.path.basename(tty_path)  # e.g. ttyACM0
-    base = f"/sys/class/tty/{tty_name}"
-    if not os.path.exists(base):
-        return None
-
-    # Walk up a few levels until we find idVendor
-    path = os.path.realpath(os.path.join(base, "device"))
-    for _ in range(5):
-        vid_path = os.path.join(path, "idVendor")
-        pid_path = os.path.join(path, "idProduct")
-        if os.path.exists(vid_path) and os.path.exists(pid_path):
-            return path
-        new_path = os.path.dirname(path)
-        if new_path == path:
-            break
-        path = new_path
-    return None
-
-
-def detect_esp32_acm():
-    """
-    Auto-detect ESP32 (Espressif VID 303a) among /dev/ttyACM* devices.
-    Returns path string or None.
-    """
-    candidates = sorted(glob.glob("/dev/ttyACM*"))
-    if not candidates:
-        print("Auto-detect: no /dev/ttyACM* devices found")
-        return None
-
-    print("Auto-detect: scanning /dev/ttyACM* for ESP32 (VID 303a)...")
-    esp_ports = []
-
-    for dev in candidates:
-        sysfs_usb = find_usb_parent_sysfs(dev)
-        if not sysfs_usb:
-            print(f"  {dev}: no USB parent sysfs with idVendor/idProduct")
-            continue
-
-        try:
-            with open(os.path.join(sysfs_usb, "idVendor"), "r") as f:
-                vid = f.read().strip().lower()
-            with open(os.path.join(sysfs_usb, "idProduct"), "r") as f:
-                pid = f.read().strip().lower()
-        except OSError:
-            print(f"  {dev}: failed to read idVendor/idProduct")
-            continue
-
-        print(f"  {dev}: VID={vid}, PID={pid}")
-        if vid == ESPRESSIF_USB_VID:
-            esp_ports.append(dev)
-
-    if len(esp_ports) == 1:
-        print(f"Auto-detect: selected {esp_ports[0]} (Espressif VID 303a)")
-        return esp_ports[0]
-    elif len(esp_ports) > 1:
-        print("Auto-detect: multiple ESP32-like devices found:")
-        for p in esp_ports:
-            print(f"  - {p}")
-        print("Using the first one; specify --dev explicitly if this is wrong.")
-        return esp_ports[0]
-    else:
-        print("Auto-detect: no ESP32 (VID 303a) found on /dev/ttyACM*")
-        print("Falling back to first /dev/ttyACM* device.")
-        return candidates[0]
-
-
 def run_command(cmd, check=True, capture_output=False):
     """Run a shell command"""
     try:
@@ -115,10 +46,20 @@ def run_command(cmd, check=True, capture_output=False):
         return None
 
 
+def tun_module_loaded():
+    """Check if TUN/TAP driver is loaded (or built into the kernel)"""
+    if os.path.isdir("/sys/module/tun"):
+        return True
+    try:
+        with open("/proc/modules") as f:
+            return any(line.startswith("tun ") for line in f)
+    except OSError:
+        return False
+
+
 def check_tun_module():
     """Check if TUN/TAP module is loaded, load if not"""
-    result = run_command("lsmod | grep -q '^tun'", check=False, capture_output=True)
-    if result.returncode != 0:
+    if not tun_module_loaded():
         print("Loading TUN/TAP module...")
         run_command("modprobe tun")
     else:
@@ -127,12 +68,7 @@ def check_tun_module():
 
 def interface_exists(ifname):
     """Check if network interface exists"""
-    result = run_command(
-        f"ip link show {ifname}",
-        check=False,
-        capture_output=True
-    )
-    return result.returncode == 0
+    return os.path.isdir(f"/sys/class/net/{ifname}")
 
 
 def create_tap_interface():
@@ -142,9 +78,16 @@ def create_tap_interface():
         return
 
     print(f"Creating TAP interface: {TAP_IF}")
-    run_command(f"ip tuntap add mode tap {TAP_IF}")
-    run_command(f"ip addr add {IP_ADDR}/24 dev {TAP_IF}")
-    run_command(f"ip link set {TAP_IF} up")
+    try:
+        with IPRoute() as ipr:
+            ipr.link("add", ifname=TAP_IF, kind="tuntap", mode="tap")
+            idx = ipr.link_lookup(ifname=TAP_IF)[0]
+            ipr.addr("add", index=idx, address=IP_ADDR, prefixlen=24)
+            ipr.link("set", index=idx, state="up")
+    except NetlinkError as e:
+        print(f"Error creating TAP interface {TAP_IF}")
+        print(f"Error: {e}")
+        sys.exit(1)
     print("TAP interface created and configured")
 
 
@@ -188,7 +131,7 @@ def main():
     # Auto-detect USB device if not specified
     usb_dev = args.dev
     if not usb_dev:
-        usb_dev = detect_esp32_acm()
+        usb_dev = cached_detect()
         if not usb_dev:
             print("Error: Could not auto-detect ESP32 USB device")
             print("Please specify --dev manually: --dev /dev/ttyACM1")
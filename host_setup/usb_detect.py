@@ -0,0 +1,205 @@
+"""
+ESP32 USB device detection
+Shared by setup_tap.py and bridge_usb.py to locate the ESP32 /dev/ttyACM* port
+"""
+
+import os
+import glob
+import select
+import struct
+import ctypes
+import functools
+
+try:
+    import pyudev
+except ImportError:
+    pyudev = None
+
+ESPRESSIF_USB_VID = "303a"  # Espressif vendor ID (seed XIAO ESP32-C3 uses this)
+
+# inotify constants (linux/inotify.h)
+IN_CREATE = 0x00000100
+INOTIFY_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len
+
+_libc = ctypes.CDLL(None, use_errno=True)
+
+
+def find_usb_parent_sysfs(tty_path):
+    """
+    Given /dev/ttyACM0, find the corresponding USB device sysfs directory
+    that contains idVendor / idProduct.
+    Returns an O_PATH directory fd (caller closes it) or None.
+    """
+    tty_name = os.path.basename(tty_path)  # e.g. ttyACM0
+    base = f"/sys/class/tty/{tty_name}"
+    if not os.path.exists(base):
+        return None
+
+    # Walk up a few levels until we find idVendor
+    path = os.path.realpath(os.path.join(base, "device"))
+    for _ in range(5):
+        vid_path = os.path.join(path, "idVendor")
+        pid_path = os.path.join(path, "idProduct")
+        if os.path.exists(vid_path) and os.path.exists(pid_path):
+            return os.open(path, os.O_PATH | os.O_DIRECTORY)
+        new_path = os.path.dirname(path)
+        if new_path == path:
+            break
+        path = new_path
+    return None
+
+
+def read_sysfs_attr(dirfd, name):
+    """Read a small sysfs attribute relative to dirfd"""
+    fd = os.open(name, os.O_RDONLY, dir_fd=dirfd)
+    try:
+        return os.read(fd, 8).decode().strip().lower()
+    finally:
+        os.close(fd)
+
+
+def is_esp32_tty(dev):
+    """Check whether a tty device belongs to an Espressif (VID 303a) USB device"""
+    sysfs_fd = find_usb_parent_sysfs(dev)
+    if sysfs_fd is None:
+        return False
+    try:
+        return read_sysfs_attr(sysfs_fd, "idVendor") == ESPRESSIF_USB_VID
+    except OSError:
+        return False
+    finally:
+        os.close(sysfs_fd)
+
+
+def detect_esp32_acm_udev():
+    """
+    Look up ESP32 tty devices in the udev database by vendor ID.
+    Returns a sorted list of device nodes, or None if pyudev is unavailable.
+    """
+    if pyudev is None:
+        return None
+    try:
+        ctx = pyudev.Context()
+        devs = ctx.list_devices(subsystem="tty", ID_VENDOR_ID=ESPRESSIF_USB_VID)
+        return sorted(d.device_node for d in devs if d.device_node)
+    except Exception:
+        return None
+
+
+def detect_esp32_acm():
+    """
+    Auto-detect ESP32 (Espressif VID 303a) among /dev/ttyACM* devices.
+    Uses the udev database when pyudev is installed, otherwise falls back
+    to globbing /dev/ttyACM* and walking sysfs.
+    Returns path string or None.
+    """
+    udev_ports = detect_esp32_acm_udev()
+    if udev_ports:
+        print(f"Auto-detect: selected {udev_ports[0]} (Espressif VID 303a, via udev)")
+        return udev_ports[0]
+
+    candidates = sorted(glob.glob("/dev/ttyACM*"))
+    if not candidates:
+        print("Auto-detect: no /dev/ttyACM* devices found")
+        return None
+
+    print("Auto-detect: scanning /dev/ttyACM* for ESP32 (VID 303a)...")
+    esp_ports = []
+
+    for dev in candidates:
+        sysfs_fd = find_usb_parent_sysfs(dev)
+        if sysfs_fd is None:
+            print(f"  {dev}: no USB parent sysfs with idVendor/idProduct")
+            continue
+
+        try:
+            vid = read_sysfs_attr(sysfs_fd, "idVendor")
+            pid = read_sysfs_attr(sysfs_fd, "idProduct")
+        except OSError:
+            print(f"  {dev}: failed to read idVendor/idProduct")
+            continue
+        finally:
+            os.close(sysfs_fd)
+
+        print(f"  {dev}: VID={vid}, PID={pid}")
+        if vid == ESPRESSIF_USB_VID:
+            # Stop at the first Espressif device; use --dev to pick another
+            esp_ports.append(dev)
+            break
+
+    if esp_ports:
+        print(f"Auto-detect: selected {esp_ports[0]} (Espressif VID 303a)")
+        return esp_ports[0]
+    else:
+        print("Auto-detect: no ESP32 (VID 303a) found on /dev/ttyACM*")
+        print("Falling back to first /dev/ttyACM* device.")
+        return candidates[0]
+
+
+@functools.lru_cache(maxsize=None)
+def cached_detect():
+    """
+    detect_esp32_acm(), run at most once per process.
+    Returns path string or None.
+    """
+    return detect_esp32_acm()
+
+
+def watch_dev(dev=None):
+    """
+    Start watching /dev for newly created device nodes.
+    If dev is a symlink in another directory (e.g. /dev/serial/by-id/...),
+    that directory is watched too, so the link is seen when it reappears.
+    Returns a non-blocking inotify fd (caller closes it).
+    """
+    fd = _libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    if fd < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    dirs = [b"/dev"]
+    if dev:
+        dev_dir = os.path.dirname(os.path.abspath(dev))
+        if dev_dir != "/dev" and os.path.isdir(dev_dir):
+            dirs.append(os.fsencode(dev_dir))
+    for path in dirs:
+        if _libc.inotify_add_watch(fd, path, IN_CREATE) < 0:
+            err = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(err, os.strerror(err))
+    return fd
+
+
+def wait_for_esp32(inotify_fd, dev=None, dev_node=None):
+    """
+    Block until a matching tty node is created in /dev.
+    If dev is given, wait for it to be created again, either as dev itself
+    (seen through the directory watch_dev(dev) added for it) or as
+    dev_node, the node dev resolved to while it was present.
+    Otherwise wait for any /dev/ttyACM* that belongs to an Espressif
+    (VID 303a) device.
+    Returns path string.
+    """
+    want_dev = os.path.basename(dev) if dev else None
+    want_node = os.path.basename(dev_node) if dev_node else None
+    while True:
+        select.select([inotify_fd], [], [])
+        while True:
+            try:
+                buf = os.read(inotify_fd, 4096)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(buf):
+                _, mask, _, name_len = INOTIFY_EVENT.unpack_from(buf, offset)
+                offset += INOTIFY_EVENT.size
+                name = buf[offset:offset + name_len].rstrip(b"\0").decode()
+                offset += name_len
+                if not mask & IN_CREATE:
+                    continue
+                if dev:
+                    if name == want_dev and os.path.exists(dev):
+                        return dev
+                    if name == want_node:
+                        return dev_node
+                elif name.startswith("ttyACM") and is_esp32_tty(f"/dev/{name}"):
+                    return f"/dev/{name}"